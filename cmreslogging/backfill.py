@@ -0,0 +1,407 @@
+""" Command line tool to backfill archived log files into the handler indices
+"""
+
+import argparse
+import calendar
+import collections
+import datetime
+import gzip
+import io
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import re
+import sys
+import time
+from elasticsearch.helpers import BulkIndexError
+
+from cmreslogging.handlers import CMRESHandler
+from cmreslogging.serializers import CMRESSerializer
+from cmreslogging.transports import CMRESFileTransport
+
+_TIMESTAMP_REGEX = re.compile(r'^\s*(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?'
+                              r'(?:(Z)|([+-])(\d{2}):?(\d{2}))?')
+_MILLISECONDS_THRESHOLD = 1e11
+# Chunks grow past the batch size up to this factor waiting for a line that starts a new record
+_MAX_CHUNK_GROWTH = 10
+_SERIALIZER = CMRESSerializer()
+
+
+def _parse_timestamp(value):
+    """ Returns the epoch of a timestamp found in a log file
+
+    Epoch numbers, in seconds or milliseconds, and strings starting with an ISO 8601 like date are supported.
+    Strings ending in Z or with a +HH:MM offset are converted to UTC, while the rest are considered local
+    time, as written by ```logging.Formatter``` asctime.
+
+    :param value: The value to parse
+    :return: A float with the epoch or None when the value is not a valid timestamp
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        epoch = float(value)
+        if abs(epoch) > _MILLISECONDS_THRESHOLD:
+            epoch /= 1000
+    else:
+        if not isinstance(value, (str, type(u''))):
+            return None
+        match = _TIMESTAMP_REGEX.match(value)
+        if match is None:
+            return None
+        year, month, day, hour, minute, second = (int(group) for group in match.group(1, 2, 3, 4, 5, 6))
+        fraction = float("0.{0!s}".format(match.group(7))) if match.group(7) else 0.0
+        date_tuple = (year, month, day, hour, minute, second, 0, 0, -1)
+        try:
+            if match.group(8):
+                epoch = calendar.timegm(date_tuple) + fraction
+            elif match.group(9):
+                offset = (int(match.group(10)) * 60 + int(match.group(11))) * 60
+                epoch = calendar.timegm(date_tuple) + fraction - (offset if match.group(9) == '+' else -offset)
+            else:
+                epoch = time.mktime(date_tuple) + fraction
+        except (ValueError, OverflowError):
+            return None
+    try:
+        # Make sure the epoch can be turned into the index name and timestamp field
+        datetime.datetime.fromtimestamp(epoch)
+        datetime.datetime.utcfromtimestamp(epoch)
+    except (ValueError, OverflowError, OSError):
+        return None
+    return epoch
+
+
+def _parse_lines(settings, lines):
+    """ Transforms a chunk of lines into documents ready to be indexed
+
+    Runs in the worker processes so it only receives picklable arguments. The documents are serialised
+    here so the parent process only passes the JSON strings on to the transport.
+
+    :param settings: A dictionary with the backfill settings, see ```CMRESBackfill._settings```
+    :param lines: A list of strings read from the log file
+    :return: A tuple with the list of (index name, serialised document) pairs and the number of lines skipped
+    """
+    index_name_func = CMRESHandler._INDEX_FREQUENCY_FUNCION_DICT[
+        CMRESHandler.IndexNameFrequency[settings['index_name_frequency']]]
+    documents = []
+    skipped = 0
+    # Lines without a timestamp, such as traceback lines, belong to the previous line with one
+    last_created = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        record = None
+        if settings['format'] != 'text' and line.lstrip().startswith('{'):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+        if not isinstance(record, dict):
+            if settings['format'] == 'json':
+                skipped += 1
+                continue
+            record = {'message': line}
+            created = _parse_timestamp(line)
+        else:
+            created = None
+            for key in settings['timestamp_keys']:
+                if key in record:
+                    created = _parse_timestamp(record[key])
+                    if created is not None:
+                        break
+        if created is not None:
+            last_created = created
+        elif last_created is not None:
+            created = last_created
+        else:
+            created = settings['default_created']
+
+        rec = settings['fields'].copy()
+        for key, value in record.items():
+            if key not in CMRESHandler._LOGGING_FILTER_FIELDS:
+                rec[key] = "" if value is None else value
+        rec[settings['timestamp_field_name']] = CMRESHandler._get_es_datetime_str(created)
+        index_name = index_name_func.__func__(settings['es_index_name'],
+                                              datetime.datetime.fromtimestamp(created))
+        documents.append((index_name, _SERIALIZER.dumps(rec)))
+    return documents, skipped
+
+
+class CMRESBackfill(object):
+    """ Backfills log files into the indices written by a CMRESHandler
+
+    Files are streamed in chunks, the chunks are parsed on a pool of processes and the resulting
+    documents are shipped through the handler transport in the same batches the handler uses, from
+    a pool of threads so several bulk requests are in flight at once.
+    JSON lines are indexed with their own fields, any other line is indexed as the message.
+    """
+
+    __DEFAULT_PROCESSES = multiprocessing.cpu_count()
+    __DEFAULT_FORMAT = 'auto'
+    __DEFAULT_ENCODING = 'utf-8'
+    __DEFAULT_REPORT_FREQ_INSEC = 10
+    __DEFAULT_BULK_THREADS = 4
+
+    FORMATS = ['auto', 'json', 'text']
+
+    def __init__(self,
+                 handler,
+                 processes=__DEFAULT_PROCESSES,
+                 log_format=__DEFAULT_FORMAT,
+                 timestamp_key=None,
+                 additional_fields=None,
+                 encoding=__DEFAULT_ENCODING,
+                 report_frequency_in_sec=__DEFAULT_REPORT_FREQ_INSEC,
+                 report_stream=None,
+                 bulk_threads=__DEFAULT_BULK_THREADS):
+        """ Backfill constructor
+
+        :param handler: The ```CMRESHandler``` providing the index naming, timestamp field, buffer size and
+                    transport
+        :param processes: An int with the number of processes parsing the files. 1 parses in the current process
+        :param log_format: One of ```auto```, ```json``` or ```text```. With ```json``` lines that are not JSON
+                    objects are skipped, with ```text``` every line is indexed as the message
+        :param timestamp_key: The key holding the timestamp of the JSON lines. The handler timestamp field name,
+                    ```created``` and ```asctime``` are tried when not provided. Text lines use a leading date
+                    if any. Lines without a timestamp use the one of the previous line in the chunk, or the file
+                    modification time when there is none
+        :param additional_fields: A dictionary with the fields added to every document. The ```host``` and
+                    ```host_ip``` fields of the handler are not added as the files were produced elsewhere
+        :param encoding: The encoding of the files, ```utf-8``` by default
+        :param report_frequency_in_sec: A float with how often the progress is reported, 0 disables it
+        :param report_stream: The stream the throughput is reported to, nothing is reported if None
+        :param bulk_threads: An int with the number of batches sent to the transport concurrently
+        :return: A ready to be used CMRESBackfill.
+        """
+        self.handler = handler
+        self.processes = max(1, processes)
+        self.log_format = log_format
+        self.timestamp_keys = [timestamp_key] if timestamp_key else [handler.default_timestamp_field_name,
+                                                                     'created', 'asctime']
+        self.additional_fields = (additional_fields or {}).copy()
+        self.encoding = encoding
+        self.report_frequency_in_sec = report_frequency_in_sec
+        self.report_stream = report_stream
+        self.bulk_threads = max(1, bulk_threads)
+
+        self.lines = 0
+        self.documents = 0
+        self.skipped = 0
+        self.failed = 0
+        self._start_time = None
+        self._last_report = None
+
+    def _settings(self, path):
+        return {
+            'es_index_name': self.handler.es_index_name,
+            'index_name_frequency': self.handler.index_name_frequency.name,
+            'timestamp_field_name': self.handler.default_timestamp_field_name,
+            'timestamp_keys': self.timestamp_keys,
+            'fields': self.additional_fields,
+            'format': self.log_format,
+            'default_created': os.path.getmtime(path),
+        }
+
+    def __open(self, path):
+        if path.endswith('.gz'):
+            return io.TextIOWrapper(gzip.open(path, 'rb'), encoding=self.encoding, errors='replace')
+        return io.open(path, 'r', encoding=self.encoding, errors='replace')
+
+    def __read_chunks(self, path):
+        # Chunks are only cut before a JSON or dated line, so lines without a timestamp, such as
+        # tracebacks, are parsed in the same chunk as the line they belong to
+        max_size = self.handler.buffer_size * _MAX_CHUNK_GROWTH
+        with self.__open(path) as log_file:
+            chunk = []
+            for line in log_file:
+                if len(chunk) >= max_size or (len(chunk) >= self.handler.buffer_size and (
+                        line.lstrip().startswith('{') or _TIMESTAMP_REGEX.match(line))):
+                    yield chunk
+                    chunk = []
+                chunk.append(line)
+            if chunk:
+                yield chunk
+
+    def __send(self, documents):
+        if not documents:
+            return 0
+        try:
+            self.handler.transport.send(
+                {
+                    '_index': index_name,
+                    '_type': self.handler.es_doc_type,
+                    '_source': document
+                }
+                for index_name, document in documents
+            )
+        except BulkIndexError as error:
+            return len(error.errors)
+        return 0
+
+    def __account(self, lines, result, sent):
+        documents, skipped = result
+        failed = sent.get()
+        self.lines += lines
+        self.documents += len(documents) - failed
+        self.skipped += skipped
+        self.failed += failed
+        if self.report_frequency_in_sec and time.time() - self._last_report >= self.report_frequency_in_sec:
+            self.report()
+
+    def report(self, prefix="Progress"):
+        """ Writes the throughput achieved so far into the report stream
+
+        :param prefix: A string starting the report line
+        :return: None
+        """
+        self._last_report = time.time()
+        if self.report_stream is None:
+            return
+        elapsed = max(self._last_report - self._start_time, 1e-6)
+        self.report_stream.write(
+            "{0!s}: {1:d} lines read, {2:d} documents indexed, {3:d} documents failed, {4:d} lines skipped "
+            "in {5:.1f}s ({6:.0f} lines/s, {7:.0f} documents/s)\n".format(prefix, self.lines, self.documents,
+                                                                          self.failed, self.skipped, elapsed,
+                                                                          self.lines / elapsed,
+                                                                          self.documents / elapsed))
+        self.report_stream.flush()
+
+    def run(self, paths):
+        """ Backfills the files
+
+        :param paths: A list with the paths of the files to backfill, gzip files are supported
+        :return: An int with the number of documents indexed. Documents rejected by elasticsearch are counted
+                    in ```failed``` and do not stop the backfill
+        """
+        self._start_time = self._last_report = time.time()
+        # Bound the chunks in flight so the files are never loaded into memory
+        parsing = collections.deque()
+        sending = collections.deque()
+        pool = multiprocessing.Pool(self.processes) if self.processes > 1 else None
+        senders = multiprocessing.pool.ThreadPool(self.bulk_threads)
+        completed = False
+
+        def ship(lines, result):
+            sending.append((lines, result, senders.apply_async(self.__send, (result[0],))))
+            while len(sending) > self.bulk_threads:
+                self.__account(*sending.popleft())
+
+        try:
+            for path in paths:
+                settings = self._settings(path)
+                for chunk in self.__read_chunks(path):
+                    if pool is None:
+                        ship(len(chunk), _parse_lines(settings, chunk))
+                        continue
+                    parsing.append((len(chunk), pool.apply_async(_parse_lines, (settings, chunk))))
+                    if len(parsing) >= self.processes * 2:
+                        lines, result = parsing.popleft()
+                        ship(lines, result.get())
+            while parsing:
+                lines, result = parsing.popleft()
+                ship(lines, result.get())
+            while sending:
+                self.__account(*sending.popleft())
+            completed = True
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            senders.terminate()
+            senders.join()
+            self.handler.transport.close()
+            self.report("Done" if completed else "Aborted")
+        return self.documents
+
+
+def _parse_field(value):
+    key, separator, field_value = value.partition('=')
+    if not separator or not key:
+        raise argparse.ArgumentTypeError("Fields must be provided as key=value, got {0!s}".format(value))
+    return key, field_value
+
+
+def _parse_host(value):
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError("Hosts must be provided as host:port, got {0!s}".format(value))
+    return {'host': host, 'port': int(port)}
+
+
+def main(argv=None):
+    """ Entry point of the ```cmres-backfill``` command
+
+    :param argv: The list of arguments, ```sys.argv``` by default
+    :return: An int with the exit code, 1 when any document failed to index
+    """
+    parser = argparse.ArgumentParser(
+        prog='cmres-backfill',
+        description="Backfill JSON lines or plain text log files into the indices written by CMRESHandler")
+    parser.add_argument('paths', nargs='+', metavar='FILE', help="Log files to backfill, gzip files are supported")
+    parser.add_argument('--host', dest='hosts', action='append', type=_parse_host,
+                        help="Elasticsearch host as host:port, can be repeated. localhost:9200 by default")
+    parser.add_argument('--auth-type', choices=[auth_type.name for auth_type in CMRESHandler.AuthType],
+                        default=CMRESHandler.AuthType.NO_AUTH.name)
+    parser.add_argument('--auth-user', default='')
+    parser.add_argument('--auth-password', default='')
+    parser.add_argument('--aws-access-key', default='')
+    parser.add_argument('--aws-secret-key', default='')
+    parser.add_argument('--aws-region', default='')
+    parser.add_argument('--host-selection', default=CMRESHandler.HostSelection.LATENCY_AWARE.name,
+                        choices=[host_selection.name for host_selection in CMRESHandler.HostSelection])
+    parser.add_argument('--sniff', action='store_true', help="Discover the nodes of the cluster by sniffing")
+    parser.add_argument('--use-ssl', action='store_true')
+    parser.add_argument('--no-verify-ssl', dest='verify_ssl', action='store_false')
+    parser.add_argument('--index-name', default='python_logger', help="Prefix of the indices")
+    parser.add_argument('--index-name-frequency', default=CMRESHandler.IndexNameFrequency.DAILY.name,
+                        choices=[frequency.name for frequency in CMRESHandler.IndexNameFrequency])
+    parser.add_argument('--doc-type', default='python_log')
+    parser.add_argument('--timestamp-field-name', default='timestamp',
+                        help="Name of the timestamp field in the indexed documents")
+    parser.add_argument('--timestamp-key', default=None, help="Key holding the timestamp of the JSON lines")
+    parser.add_argument('--field', dest='fields', action='append', type=_parse_field, default=[],
+                        help="Additional field added to every document as key=value, can be repeated")
+    parser.add_argument('--format', dest='log_format', choices=CMRESBackfill.FORMATS, default='auto')
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--bulk-threads', type=int, default=4, help="Number of bulk requests sent concurrently")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Number of lines sent per bulk request")
+    parser.add_argument('--report-every', type=float, default=10, help="Seconds between progress reports")
+    parser.add_argument('--output-file', default=None,
+                        help="Write NDJSON documents into this file instead of indexing them into Elasticsearch")
+    args = parser.parse_args(argv)
+
+    handler = CMRESHandler(hosts=args.hosts or [{'host': 'localhost', 'port': 9200}],
+                           auth_details=(args.auth_user, args.auth_password),
+                           aws_access_key=args.aws_access_key,
+                           aws_secret_key=args.aws_secret_key,
+                           aws_region=args.aws_region,
+                           auth_type=CMRESHandler.AuthType[args.auth_type],
+                           use_ssl=args.use_ssl,
+                           verify_ssl=args.verify_ssl,
+                           buffer_size=args.batch_size,
+                           es_index_name=args.index_name,
+                           index_name_frequency=CMRESHandler.IndexNameFrequency[args.index_name_frequency],
+                           es_doc_type=args.doc_type,
+                           raise_on_indexing_exceptions=True,
+                           default_timestamp_field_name=args.timestamp_field_name,
+                           transport=CMRESFileTransport(args.output_file) if args.output_file else None,
+                           host_selection=CMRESHandler.HostSelection[args.host_selection],
+                           sniff_hosts=args.sniff)
+    backfill = CMRESBackfill(handler,
+                             processes=args.processes,
+                             log_format=args.log_format,
+                             timestamp_key=args.timestamp_key,
+                             additional_fields=dict(args.fields),
+                             encoding=args.encoding,
+                             report_frequency_in_sec=args.report_every,
+                             report_stream=sys.stderr,
+                             bulk_threads=args.bulk_threads)
+    backfill.run(args.paths)
+    return 1 if backfill.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+""" Latency aware connection selection across the configured Elasticsearch hosts
+"""
+
+import random
+import time
+from threading import Lock
+from elasticsearch import RequestsHttpConnection, TransportError
+from elasticsearch.connection_pool import ConnectionSelector
+
+
+class CMRESHostStats(object):
+    """ Tracks the request latency and error rate of every Elasticsearch host
+
+    Latency and error rate are exponentially weighted moving averages. Every consecutive failure of
+    a host puts it on a cool down period that doubles each time, up to a maximum, and a success
+    clears it.
+    """
+
+    __DEFAULT_DECAY = 0.3
+    __DEFAULT_COOL_DOWN_INSEC = 1
+    __DEFAULT_MAX_COOL_DOWN_INSEC = 300
+
+    class _HostStat(object):
+        """ Statistics of a single host
+        """
+        __slots__ = ('latency', 'error_rate', 'failures', 'cooled_until')
+
+        def __init__(self):
+            self.latency = None
+            self.error_rate = 0.0
+            self.failures = 0
+            self.cooled_until = 0.0
+
+    def __init__(self,
+                 decay=__DEFAULT_DECAY,
+                 cool_down_in_sec=__DEFAULT_COOL_DOWN_INSEC,
+                 max_cool_down_in_sec=__DEFAULT_MAX_COOL_DOWN_INSEC):
+        """ Host statistics constructor
+
+        :param decay: A float between 0 and 1 with the weight given to the latest request in the moving averages
+        :param cool_down_in_sec: A float with the seconds a host is avoided after its first consecutive failure
+        :param max_cool_down_in_sec: A float with the maximum seconds a host is avoided
+        :return: A ready to be used CMRESHostStats.
+        """
+        self.decay = decay
+        self.cool_down_in_sec = cool_down_in_sec
+        self.max_cool_down_in_sec = max_cool_down_in_sec
+        self._hosts = {}
+        self._lock = Lock()
+
+    def __get(self, host):
+        stat = self._hosts.get(host)
+        if stat is None:
+            stat = self._hosts[host] = CMRESHostStats._HostStat()
+        return stat
+
+    def record_success(self, host, latency):
+        """ Records a successful request
+
+        :param host: A string identifying the host
+        :param latency: A float with the seconds the request took
+        :return: None
+        """
+        with self._lock:
+            stat = self.__get(host)
+            stat.latency = latency if stat.latency is None else \
+                self.decay * latency + (1 - self.decay) * stat.latency
+            stat.error_rate *= 1 - self.decay
+            stat.failures = 0
+            stat.cooled_until = 0.0
+
+    def record_failure(self, host, now=None):
+        """ Records a failed request and puts the host on cool down
+
+        :param host: A string identifying the host
+        :param now: The epoch of the failure, the current time by default
+        :return: None
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            stat = self.__get(host)
+            stat.error_rate = self.decay + (1 - self.decay) * stat.error_rate
+            stat.failures += 1
+            cool_down = min(self.cool_down_in_sec * 2 ** min(stat.failures - 1, 32), self.max_cool_down_in_sec)
+            stat.cooled_until = now + cool_down
+
+    def is_available(self, host, now=None):
+        """ Returns True if the host is not on cool down
+
+        :param host: A string identifying the host
+        :param now: The epoch to check, the current time by default
+        :return: A boolean
+        """
+        stat = self._hosts.get(host)
+        return stat is None or stat.cooled_until <= (time.time() if now is None else now)
+
+    def score(self, host):
+        """ Returns the score of a host, the lower the better
+
+        Hosts without any request recorded score 0 so they are tried first, while hosts that only ever
+        failed rank behind every host with a measured latency.
+
+        :param host: A string identifying the host
+        :return: A float with the latency penalised by the error rate
+        """
+        stat = self._hosts.get(host)
+        if stat is None or (stat.latency is None and stat.error_rate == 0):
+            return 0.0
+        if stat.latency is None:
+            return float('inf')
+        return stat.latency * (1 + 10 * stat.error_rate)
+
+    def snapshot(self):
+        """ Returns the statistics of every host
+
+        :return: A dictionary by host with the latency, error_rate, failures and cooled_until values
+        """
+        with self._lock:
+            return dict((host, {'latency': stat.latency,
+                                'error_rate': stat.error_rate,
+                                'failures': stat.failures,
+                                'cooled_until': stat.cooled_until})
+                        for host, stat in self._hosts.items())
+
+
+class CMRESTrackedConnection(RequestsHttpConnection):
+    """ Requests connection recording the latency and failures of every request into a CMRESHostStats
+
+    Connection errors, timeouts, 429 and 5xx responses count as failures of the host.
+    """
+
+    def __init__(self, host_stats=None, **kwargs):
+        """ Connection constructor
+
+        :param host_stats: The ```CMRESHostStats``` the requests are recorded into
+        :param kwargs: The arguments of ```RequestsHttpConnection```
+        :return: A ready to be used CMRESTrackedConnection.
+        """
+        super(CMRESTrackedConnection, self).__init__(**kwargs)
+        self.host_stats = host_stats
+
+    def perform_request(self, *args, **kwargs):
+        start = time.time()
+        try:
+            response = super(CMRESTrackedConnection, self).perform_request(*args, **kwargs)
+        except TransportError as error:
+            host_failed = not isinstance(error.status_code, int) or error.status_code == 429 \
+                or error.status_code >= 500
+            if self.host_stats is not None and host_failed:
+                self.host_stats.record_failure(self.host)
+            raise
+        if self.host_stats is not None:
+            self.host_stats.record_success(self.host, time.time() - start)
+        return response
+
+
+class CMRESLatencySelector(ConnectionSelector):
+    """ Connection selector favouring the fastest healthy hosts
+
+    Hosts on cool down are skipped unless all of them are. Two different connections are picked at
+    random and the one with the best score is used, so most of the traffic goes to the fastest hosts.
+    A small share of the requests goes to a random host so the slower ones are still probed to
+    notice when they recover.
+    """
+
+    EXPLORATION_RATE = 0.05
+
+    def select(self, connections):
+        host_stats = getattr(connections[0], 'host_stats', None)
+        if host_stats is None:
+            return random.choice(connections)
+        now = time.time()
+        available = [connection for connection in connections if host_stats.is_available(connection.host, now)]
+        candidates = available or connections
+        if len(candidates) == 1 or random.random() < CMRESLatencySelector.EXPLORATION_RATE:
+            return random.choice(candidates)
+        first, second = random.sample(candidates, 2)
+        return first if host_stats.score(first.host) <= host_stats.score(second.host) else second
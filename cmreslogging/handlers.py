@@ -6,7 +6,6 @@ import datetime
 import socket
 from threading import Timer, Lock
 from enum import Enum
-from elasticsearch import helpers as eshelpers
 from elasticsearch import Elasticsearch, RequestsHttpConnection
 
 try:
@@ -21,7 +20,9 @@ try:
 except ImportError:
     AWS4AUTH_SUPPORTED = False
 
+from cmreslogging.connections import CMRESHostStats, CMRESLatencySelector, CMRESTrackedConnection
 from cmreslogging.serializers import CMRESSerializer
+from cmreslogging.transports import CMRESElasticsearchTransport
 
 
 class CMRESHandler(logging.Handler):
@@ -44,6 +45,16 @@ class CMRESHandler(logging.Handler):
         KERBEROS_AUTH = 2
         AWS_SIGNED_AUTH = 3
 
+    class HostSelection(Enum):
+        """ Host selection strategies supported
+
+        The handler supports
+         - Round robin across the hosts, the elasticsearch client default
+         - Latency aware, favouring the fastest healthy hosts and cooling down the failing ones
+        """
+        ROUND_ROBIN = 0
+        LATENCY_AWARE = 1
+
     class IndexNameFrequency(Enum):
         """ Index type supported
         the handler supports
@@ -75,45 +86,56 @@ class CMRESHandler(logging.Handler):
     __DEFAULT_ES_DOC_TYPE = 'python_log'
     __DEFAULT_RAISE_ON_EXCEPTION = False
     __DEFAULT_TIMESTAMP_FIELD_NAME = "timestamp"
+    __DEFAULT_HOST_SELECTION = HostSelection.LATENCY_AWARE
+    __DEFAULT_HOST_COOL_DOWN_INSEC = 1
+    __DEFAULT_SNIFF_HOSTS = False
+    __DEFAULT_SNIFFER_TIMEOUT_INSEC = 60
 
-    __LOGGING_FILTER_FIELDS = ['msecs',
-                               'relativeCreated',
-                               'levelno',
-                               'created']
+    _LOGGING_FILTER_FIELDS = ['msecs',
+                              'relativeCreated',
+                              'levelno',
+                              'created']
 
     @staticmethod
-    def _get_daily_index_name(es_index_name):
+    def _get_daily_index_name(es_index_name, current_date=None):
         """ Returns elasticearch index name
         :param: index_name the prefix to be used in the index
+        :param: current_date the datetime the index is computed for, now by default
         :return: A srting containing the elasticsearch indexname used which should include the date.
         """
-        return "{0!s}-{1!s}".format(es_index_name, datetime.datetime.now().strftime('%Y.%m.%d'))
+        current_date = current_date or datetime.datetime.now()
+        return "{0!s}-{1!s}".format(es_index_name, current_date.strftime('%Y.%m.%d'))
 
     @staticmethod
-    def _get_weekly_index_name(es_index_name):
+    def _get_weekly_index_name(es_index_name, current_date=None):
         """ Return elasticsearch index name
         :param: index_name the prefix to be used in the index
+        :param: current_date the datetime the index is computed for, now by default
         :return: A srting containing the elasticsearch indexname used which should include the date and specific week
         """
-        current_date = datetime.datetime.now()
+        current_date = current_date or datetime.datetime.now()
         start_of_the_week = current_date - datetime.timedelta(days=current_date.weekday())
         return "{0!s}-{1!s}".format(es_index_name, start_of_the_week.strftime('%Y.%m.%d'))
 
     @staticmethod
-    def _get_monthly_index_name(es_index_name):
+    def _get_monthly_index_name(es_index_name, current_date=None):
         """ Return elasticsearch index name
         :param: index_name the prefix to be used in the index
+        :param: current_date the datetime the index is computed for, now by default
         :return: A srting containing the elasticsearch indexname used which should include the date and specific moth
         """
-        return "{0!s}-{1!s}".format(es_index_name, datetime.datetime.now().strftime('%Y.%m'))
+        current_date = current_date or datetime.datetime.now()
+        return "{0!s}-{1!s}".format(es_index_name, current_date.strftime('%Y.%m'))
 
     @staticmethod
-    def _get_yearly_index_name(es_index_name):
+    def _get_yearly_index_name(es_index_name, current_date=None):
         """ Return elasticsearch index name
         :param: index_name the prefix to be used in the index
+        :param: current_date the datetime the index is computed for, now by default
         :return: A srting containing the elasticsearch indexname used which should include the date and specific year
         """
-        return "{0!s}-{1!s}".format(es_index_name, datetime.datetime.now().strftime('%Y'))
+        current_date = current_date or datetime.datetime.now()
+        return "{0!s}-{1!s}".format(es_index_name, current_date.strftime('%Y'))
 
     _INDEX_FREQUENCY_FUNCION_DICT = {
         IndexNameFrequency.DAILY: _get_daily_index_name,
@@ -138,7 +160,11 @@ class CMRESHandler(logging.Handler):
                  es_doc_type=__DEFAULT_ES_DOC_TYPE,
                  es_additional_fields=__DEFAULT_ADDITIONAL_FIELDS,
                  raise_on_indexing_exceptions=__DEFAULT_RAISE_ON_EXCEPTION,
-                 default_timestamp_field_name=__DEFAULT_TIMESTAMP_FIELD_NAME):
+                 default_timestamp_field_name=__DEFAULT_TIMESTAMP_FIELD_NAME,
+                 transport=None,
+                 host_selection=__DEFAULT_HOST_SELECTION,
+                 host_cool_down_in_sec=__DEFAULT_HOST_COOL_DOWN_INSEC,
+                 sniff_hosts=__DEFAULT_SNIFF_HOSTS):
         """ Handler constructor
 
         :param hosts: The list of hosts that elasticsearch clients will connect. The list can be provided
@@ -172,6 +198,20 @@ class CMRESHandler(logging.Handler):
                     to the logs, such the application, environment, etc.
         :param raise_on_indexing_exceptions: A boolean, True only for debugging purposes to raise exceptions
                     caused when
+        :param default_timestamp_field_name: A string with the name of the field holding the log timestamp,
+                    ```timestamp``` used by default
+        :param transport: An instance of ```cmreslogging.transports.CMRESTransport``` the buffered logs are
+                    shipped through on every flush. By default the logs are bulk indexed into the
+                    Elasticsearch hosts configured
+        :param host_selection: The strategy used to pick the host of every request ```CMRESHandler.HostSelection```.
+                    LATENCY_AWARE, used by default, tracks the latency and error rate of every host, sends most
+                    of the requests to the fastest healthy ones and cools down the failing ones. ROUND_ROBIN
+                    leaves the selection to the elasticsearch client
+        :param host_cool_down_in_sec: A float with the seconds a failing host is avoided by the LATENCY_AWARE
+                    selection, doubled on every consecutive failure
+        :param sniff_hosts: A boolean, True to discover the nodes of the cluster by sniffing on start, on
+                    connection failures and every minute. With KERBEROS_AUTH a new client is created on every
+                    flush so the nodes are only sniffed on connection failures
         :return: A ready to be used CMRESHandler.
         """
         logging.Handler.__init__(self)
@@ -196,11 +236,16 @@ class CMRESHandler(logging.Handler):
         self.default_timestamp_field_name = default_timestamp_field_name
 
         self._client = None
+        self._client_lock = Lock()
         self._buffer = []
         self._buffer_lock = Lock()
         self._timer = None
         self._index_name_func = CMRESHandler._INDEX_FREQUENCY_FUNCION_DICT[self.index_name_frequency]
         self.serializer = CMRESSerializer()
+        self.host_selection = host_selection
+        self.host_stats = CMRESHostStats(cool_down_in_sec=host_cool_down_in_sec)
+        self.sniff_hosts = sniff_hosts
+        self.transport = transport if transport is not None else CMRESElasticsearchTransport(self.__get_es_client)
 
     def __schedule_flush(self):
         if self._timer is None:
@@ -208,36 +253,54 @@ class CMRESHandler(logging.Handler):
             self._timer.setDaemon(True)
             self._timer.start()
 
+    def __get_connection_kwargs(self, sniff_on_start=True):
+        kwargs = {'connection_class': RequestsHttpConnection}
+        if self.host_selection == CMRESHandler.HostSelection.LATENCY_AWARE:
+            kwargs.update(connection_class=CMRESTrackedConnection,
+                          selector_class=CMRESLatencySelector,
+                          host_stats=self.host_stats)
+        if self.sniff_hosts:
+            kwargs.update(sniff_on_start=sniff_on_start,
+                          sniff_on_connection_fail=True,
+                          sniffer_timeout=CMRESHandler.__DEFAULT_SNIFFER_TIMEOUT_INSEC)
+        return kwargs
+
     def __get_es_client(self):
+        # The transport may be used from several threads, make sure a single client is created
+        with self._client_lock:
+            return self.__get_es_client_locked()
+
+    def __get_es_client_locked(self):
         if self.auth_type == CMRESHandler.AuthType.NO_AUTH:
             if self._client is None:
                 self._client = Elasticsearch(hosts=self.hosts,
                                              use_ssl=self.use_ssl,
                                              verify_certs=self.verify_certs,
-                                             connection_class=RequestsHttpConnection,
-                                             serializer=self.serializer)
+                                             serializer=self.serializer,
+                                             **self.__get_connection_kwargs())
             return self._client
 
         if self.auth_type == CMRESHandler.AuthType.BASIC_AUTH:
             if self._client is None:
-                return Elasticsearch(hosts=self.hosts,
-                                     http_auth=self.auth_details,
-                                     use_ssl=self.use_ssl,
-                                     verify_certs=self.verify_certs,
-                                     connection_class=RequestsHttpConnection,
-                                     serializer=self.serializer)
+                self._client = Elasticsearch(hosts=self.hosts,
+                                             http_auth=self.auth_details,
+                                             use_ssl=self.use_ssl,
+                                             verify_certs=self.verify_certs,
+                                             serializer=self.serializer,
+                                             **self.__get_connection_kwargs())
             return self._client
 
         if self.auth_type == CMRESHandler.AuthType.KERBEROS_AUTH:
             if not CMR_KERBEROS_SUPPORTED:
                 raise EnvironmentError("Kerberos module not available. Please install \"requests-kerberos\"")
-            # For kerberos we return a new client each time to make sure the tokens are up to date
+            # For kerberos we return a new client each time to make sure the tokens are up to date, so
+            # sniffing on start is disabled to avoid sniffing the cluster on every flush
             return Elasticsearch(hosts=self.hosts,
                                  use_ssl=self.use_ssl,
                                  verify_certs=self.verify_certs,
-                                 connection_class=RequestsHttpConnection,
                                  http_auth=HTTPKerberosAuth(mutual_authentication=DISABLED),
-                                 serializer=self.serializer)
+                                 serializer=self.serializer,
+                                 **self.__get_connection_kwargs(sniff_on_start=False))
 
         if self.auth_type == CMRESHandler.AuthType.AWS_SIGNED_AUTH:
             if not AWS4AUTH_SUPPORTED:
@@ -249,8 +312,8 @@ class CMRESHandler(logging.Handler):
                     http_auth=awsauth,
                     use_ssl=self.use_ssl,
                     verify_certs=True,
-                    connection_class=RequestsHttpConnection,
-                    serializer=self.serializer
+                    serializer=self.serializer,
+                    **self.__get_connection_kwargs()
                 )
             return self._client
 
@@ -267,7 +330,7 @@ class CMRESHandler(logging.Handler):
         return self.__get_es_client().ping()
 
     @staticmethod
-    def __get_es_datetime_str(timestamp):
+    def _get_es_datetime_str(timestamp):
         """ Returns elasticsearch utc formatted time for an epoch timestamp
 
         :param timestamp: epoch, including milliseconds
@@ -277,7 +340,7 @@ class CMRESHandler(logging.Handler):
         return "{0!s}.{1:03d}Z".format(current_date.strftime('%Y-%m-%dT%H:%M:%S'), int(current_date.microsecond / 1000))
 
     def flush(self):
-        """ Flushes the buffer into ES
+        """ Flushes the buffer into the transport
         :return: None
         """
         if self._timer is not None and self._timer.is_alive():
@@ -297,11 +360,7 @@ class CMRESHandler(logging.Handler):
                     }
                     for log_record in logs_buffer
                 )
-                eshelpers.bulk(
-                    client=self.__get_es_client(),
-                    actions=actions,
-                    stats_only=True
-                )
+                self.transport.send(actions)
             except Exception as exception:
                 if self.raise_on_indexing_exceptions:
                     raise exception
@@ -314,6 +373,11 @@ class CMRESHandler(logging.Handler):
         if self._timer is not None:
             self.flush()
         self._timer = None
+        self.transport.close()
+
+    def __formats_exceptions_by_default(self):
+        formatter = self.formatter or logging._defaultFormatter  # pylint: disable=protected-access
+        return getattr(type(formatter), 'formatException', None) is logging.Formatter.formatException
 
     def emit(self, record):
         """ Emit overrides the abstract logging.Handler logRecord emit method
@@ -323,15 +387,23 @@ class CMRESHandler(logging.Handler):
         :param record: A class of type ```logging.LogRecord```
         :return: None
         """
+        if record.exc_info and not record.exc_text and self.__formats_exceptions_by_default():
+            # Render the traceback from the cached frames so the formatter does not render it again
+            record.exc_text = self.serializer.format_exc_info(record.exc_info)
         self.format(record)
 
         rec = self.es_additional_fields.copy()
         for key, value in record.__dict__.items():
-            if key not in CMRESHandler.__LOGGING_FILTER_FIELDS:
+            if key not in CMRESHandler._LOGGING_FILTER_FIELDS:
                 if key == "args":
                     value = tuple(str(arg) for arg in value)
+                elif key == "exc_info":
+                    # Only records with an exception get the field, so it is always mapped as an object
+                    value = self.serializer.serialize_exc_info(value) if value else None
+                    if value is None:
+                        continue
                 rec[key] = "" if value is None else value
-        rec[self.default_timestamp_field_name] = self.__get_es_datetime_str(record.created)
+        rec[self.default_timestamp_field_name] = self._get_es_datetime_str(record.created)
         with self._buffer_lock:
             self._buffer.append(rec)
 
@@ -1,5 +1,6 @@
 """ JSON serializer for Elasticsearch use
 """
+import linecache
 from elasticsearch.serializer import JSONSerializer
 
 
@@ -9,6 +10,21 @@ class CMRESSerializer(JSONSerializer):
     Allows to serialize logs for a elasticsearch use.
     Manage the record.exc_info containing an exception type.
     """
+
+    __DEFAULT_FRAME_CACHE_SIZE = 4096
+    __CAUSE_MESSAGE = "The above exception was the direct cause of the following exception:"
+    __CONTEXT_MESSAGE = "During handling of the above exception, another exception occurred:"
+
+    def __init__(self, frame_cache_size=__DEFAULT_FRAME_CACHE_SIZE):
+        """ Serializer constructor
+
+        :param frame_cache_size: An int with the maximum number of rendered traceback frames kept in the cache
+        :return: A ready to be used CMRESSerializer.
+        """
+        super(CMRESSerializer, self).__init__()
+        self.frame_cache_size = frame_cache_size
+        self._frame_cache = {}
+
     def default(self, data):
         """ Default overrides the elasticsearch default method
 
@@ -20,3 +36,89 @@ class CMRESSerializer(JSONSerializer):
             return super(CMRESSerializer, self).default(data)
         except TypeError:
             return str(data)
+
+    def __get_frame(self, code, lineno):
+        key = (code, lineno)
+        frame = self._frame_cache.get(key)
+        if frame is None:
+            line = linecache.getline(code.co_filename, lineno).strip()
+            text = '  File "{0!s}", line {1:d}, in {2!s}'.format(code.co_filename, lineno, code.co_name)
+            if line:
+                text = "{0!s}\n    {1!s}".format(text, line)
+            frame = ({'filename': code.co_filename,
+                      'lineno': lineno,
+                      'function': code.co_name,
+                      'line': line}, text)
+            if len(self._frame_cache) >= self.frame_cache_size:
+                self._frame_cache.clear()
+            self._frame_cache[key] = frame
+        return frame
+
+    def __get_frames(self, exc_traceback):
+        frames = []
+        while exc_traceback is not None:
+            frames.append(self.__get_frame(exc_traceback.tb_frame.f_code, exc_traceback.tb_lineno))
+            exc_traceback = exc_traceback.tb_next
+        return frames
+
+    @staticmethod
+    def __get_message(exc_value):
+        if exc_value is None:
+            return ""
+        try:
+            return str(exc_value)
+        except Exception:  # pylint: disable=broad-except
+            return "<exception str() failed>"
+
+    def __format_exception(self, exc_type, exc_value, exc_traceback, lines, seen):
+        if exc_value is not None:
+            seen.add(id(exc_value))
+            cause = getattr(exc_value, '__cause__', None)
+            context = getattr(exc_value, '__context__', None)
+            if cause is not None and id(cause) not in seen:
+                self.__format_exception(type(cause), cause, cause.__traceback__, lines, seen)
+                lines.extend(["", CMRESSerializer.__CAUSE_MESSAGE, ""])
+            elif context is not None and id(context) not in seen and \
+                    not getattr(exc_value, '__suppress_context__', False):
+                self.__format_exception(type(context), context, context.__traceback__, lines, seen)
+                lines.extend(["", CMRESSerializer.__CONTEXT_MESSAGE, ""])
+        if exc_traceback is not None:
+            lines.append("Traceback (most recent call last):")
+            lines.extend(text for _, text in self.__get_frames(exc_traceback))
+        type_name = getattr(exc_type, '__qualname__', exc_type.__name__)
+        if exc_type.__module__ not in ('__main__', 'builtins', 'exceptions'):
+            type_name = "{0!s}.{1!s}".format(exc_type.__module__, type_name)
+        message = self.__get_message(exc_value)
+        lines.append("{0!s}: {1!s}".format(type_name, message) if message else type_name)
+
+    def format_exc_info(self, exc_info):
+        """ Renders an exc_info tuple as ```logging.Formatter.formatException``` does
+
+        Uses the same frame cache than ```serialize_exc_info``` so repeated exceptions raised from the
+        same place are cheap to render.
+
+        :param exc_info: A tuple (type, value, traceback) as returned by ```sys.exc_info()```
+        :return: A string with the traceback, including the chained exceptions
+        """
+        exc_type, exc_value, exc_traceback = exc_info
+        if exc_type is None:
+            return ""
+        lines = []
+        self.__format_exception(exc_type, exc_value, exc_traceback, lines, set())
+        return "\n".join(lines)
+
+    def serialize_exc_info(self, exc_info):
+        """ Transforms an exc_info tuple into a structure that can be searched in elasticsearch
+
+        The frames are cached by code object and line so repeated exceptions raised from the same
+        place are cheap to serialize. The frame dictionaries returned are shared and must not be modified.
+
+        :param exc_info: A tuple (type, value, traceback) as returned by ```sys.exc_info()```
+        :return: A dictionary with the exception type, message and the list of frames, outermost first
+        """
+        exc_type, exc_value, exc_traceback = exc_info
+        if exc_type is None:
+            return None
+        return {'type': exc_type.__name__,
+                'message': self.__get_message(exc_value),
+                'frames': [frame for frame, _ in self.__get_frames(exc_traceback)]}
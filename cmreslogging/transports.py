@@ -0,0 +1,215 @@
+""" Transports used by the Elasticsearch logging handler to ship documents
+"""
+
+import io
+import json
+import os
+from threading import Lock
+from elasticsearch import helpers as eshelpers
+
+from cmreslogging.serializers import CMRESSerializer
+
+
+class CMRESTransport(object):
+    """ Base class for the handler transports
+
+    A transport receives the bulk actions built by the handler on every flush. Each action is a
+    dictionary with the ```_index```, ```_type``` and ```_source``` keys, the latter holding the
+    log document, either as a dictionary or already serialised into a JSON string.
+    """
+
+    def send(self, actions):
+        """ Ships a batch of actions
+
+        :param actions: An iterable of bulk actions
+        :return: None
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """ Releases any outstanding resource held by the transport
+
+        :return: None
+        """
+        pass
+
+
+class CMRESElasticsearchTransport(CMRESTransport):
+    """ Transport indexing the actions into Elasticsearch using the bulk helper
+    """
+
+    def __init__(self, client_factory):
+        """ Transport constructor
+
+        :param client_factory: A callable returning the ```Elasticsearch``` client to use on each send
+        :return: A ready to be used CMRESElasticsearchTransport.
+        """
+        self._client_factory = client_factory
+
+    def send(self, actions):
+        """ Indexes the actions through the elasticsearch bulk helper
+
+        Every action is sent even if some of them are rejected, the rejected ones are reported at the end.
+
+        :param actions: An iterable of bulk actions
+        :return: None
+        :raises BulkIndexError: When any of the documents could not be indexed, with the failed items as errors
+        """
+        errors = [item for succeeded, item in eshelpers.streaming_bulk(client=self._client_factory(),
+                                                                       actions=actions,
+                                                                       raise_on_error=False)
+                  if not succeeded]
+        if errors:
+            raise eshelpers.BulkIndexError("{0:d} document(s) failed to index.".format(len(errors)), errors)
+
+
+class CMRESFileTransport(CMRESTransport):
+    """ Transport writing the documents into a file, one JSON document per line (NDJSON)
+
+    The file is intended to be picked up by a log shipper. Each flush is serialised into a single
+    write and the file is rotated in the same way ```logging.handlers.RotatingFileHandler``` does.
+    When the file is moved or removed by someone else it is reopened, as
+    ```logging.handlers.WatchedFileHandler``` does.
+    """
+
+    __DEFAULT_MAX_BYTES = 0
+    __DEFAULT_BACKUP_COUNT = 0
+    __DEFAULT_ENCODING = 'utf-8'
+
+    def __init__(self,
+                 filename,
+                 max_bytes=__DEFAULT_MAX_BYTES,
+                 backup_count=__DEFAULT_BACKUP_COUNT,
+                 encoding=__DEFAULT_ENCODING,
+                 serializer=None):
+        """ Transport constructor
+
+        :param filename: The path of the file the documents will be appended to
+        :param max_bytes: An int, once the file would grow over this size it is rotated before writing. Rotation
+                    happens on batch boundaries so a batch is never split across files. 0 disables the rotation
+        :param backup_count: An int with the number of rotated files to keep, named ```filename.1```,
+                    ```filename.2```, etc. When 0 the file is truncated on rotation
+        :param encoding: The encoding used to write the file, ```utf-8``` by default
+        :param serializer: The serializer used to dump the documents, a ```CMRESSerializer``` by default
+        :return: A ready to be used CMRESFileTransport.
+        """
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.encoding = encoding
+        self.serializer = serializer if serializer is not None else CMRESSerializer()
+
+        self._stream = None
+        self._size = 0
+        self._dev = None
+        self._ino = None
+        self._lock = Lock()
+
+    def __open(self):
+        self._stream = io.open(self.filename, 'ab')
+        self._size = self._stream.tell()
+        stream_stat = os.fstat(self._stream.fileno())
+        self._dev, self._ino = stream_stat.st_dev, stream_stat.st_ino
+
+    def __reopen_if_moved(self):
+        # Same check as logging.handlers.WatchedFileHandler, the file may be moved by logrotate or a shipper
+        try:
+            file_stat = os.stat(self.filename)
+        except OSError:
+            file_stat = None
+        if file_stat is None or file_stat.st_dev != self._dev or file_stat.st_ino != self._ino:
+            self._stream.close()
+            self.__open()
+
+    def __rotate(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        for index in range(self.backup_count - 1, 0, -1):
+            source = "{0!s}.{1:d}".format(self.filename, index)
+            if os.path.exists(source):
+                os.rename(source, "{0!s}.{1:d}".format(self.filename, index + 1))
+        if os.path.exists(self.filename):
+            if self.backup_count > 0:
+                os.rename(self.filename, "{0!s}.1".format(self.filename))
+            else:
+                os.remove(self.filename)
+        self.__open()
+
+    def send(self, actions):
+        """ Appends the documents of the actions to the file
+
+        :param actions: An iterable of bulk actions
+        :return: None
+        """
+        # Only text is encoded, python 2 byte strings are written as they are
+        lines = [line if isinstance(line, bytes) else line.encode(self.encoding)
+                 for line in (self.serializer.dumps(action['_source']) for action in actions)]
+        if not lines:
+            return
+        lines.append(b'')
+        data = b'\n'.join(lines)
+
+        with self._lock:
+            if self._stream is None:
+                self.__open()
+            else:
+                self.__reopen_if_moved()
+            if 0 < self.max_bytes < self._size + len(data) and self._size > 0:
+                self.__rotate()
+            self._stream.write(data)
+            self._stream.flush()
+            self._size += len(data)
+
+    def close(self):
+        """ Closes the underlying file, it will be reopened on the next send
+
+        :return: None
+        """
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+
+class CMRESMemoryTransport(CMRESTransport):
+    """ Transport keeping the actions in memory
+
+    Useful to test or benchmark the handler pipeline without an Elasticsearch cluster.
+    """
+
+    def __init__(self):
+        """ Transport constructor
+
+        :return: A ready to be used CMRESMemoryTransport.
+        """
+        self.actions = []
+        self._lock = Lock()
+
+    @property
+    def documents(self):
+        """ Returns the documents received so far
+
+        :return: A list with the ```_source``` of every action received, serialised ones are loaded back
+        """
+        with self._lock:
+            return [action['_source'] if isinstance(action['_source'], dict) else json.loads(action['_source'])
+                    for action in self.actions]
+
+    def send(self, actions):
+        """ Stores the actions
+
+        :param actions: An iterable of bulk actions
+        :return: None
+        """
+        actions = list(actions)
+        with self._lock:
+            self.actions.extend(actions)
+
+    def clear(self):
+        """ Drops every action stored so far
+
+        :return: None
+        """
+        with self._lock:
+            self.actions = []
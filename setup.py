@@ -113,5 +113,8 @@ setup(
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
     entry_points={
+        'console_scripts': [
+            'cmres-backfill=cmreslogging.backfill:main',
+        ],
     },
 )
@@ -0,0 +1,206 @@
+""" Test class for the backfill module
+"""
+import unittest
+import calendar
+import datetime
+import gzip
+import io
+import json
+import multiprocessing.pool
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.abspath('.'))
+from cmreslogging.backfill import CMRESBackfill, main, _parse_timestamp
+from cmreslogging.handlers import CMRESHandler
+from elasticsearch import ConnectionError
+from elasticsearch.helpers import BulkIndexError
+from cmreslogging.transports import CMRESMemoryTransport
+
+
+class RejectingTransport(CMRESMemoryTransport):
+    def send(self, actions):
+        actions = list(actions)
+        super(RejectingTransport, self).send(actions[1:])
+        raise BulkIndexError("1 document(s) failed to index.", [{'index': actions[0]}])
+
+
+class FailingTransport(CMRESMemoryTransport):
+    def __init__(self):
+        super(FailingTransport, self).__init__()
+        self.closed = False
+
+    def send(self, actions):
+        raise ConnectionError("N/A", "Connection refused", None)
+
+    def close(self):
+        self.closed = True
+
+
+class CMRESBackfillTestCase(unittest.TestCase):
+    """ CMRESBackfill test class
+    """
+
+    def setUp(self):
+        """ Creates a temporary folder with a JSON lines and a plain text log file
+        """
+        self.folder = tempfile.mkdtemp()
+        self.json_filename = os.path.join(self.folder, 'app.json.gz')
+        with gzip.open(self.json_filename, 'wt') as json_file:
+            for i in range(250):
+                json_file.write(json.dumps({'msg': 'Line', 'LineNum': i, 'levelno': 20,
+                                            'timestamp': '2017-03-0{0:d}T10:00:00.250Z'.format(1 + i % 2)}))
+                json_file.write('\n')
+            json_file.write('this line is not json\n')
+        self.text_filename = os.path.join(self.folder, 'app.log')
+        with open(self.text_filename, 'w') as text_file:
+            text_file.write('Message without timestamp\n')
+            text_file.write('\n')
+            text_file.write('2017-03-01 10:00:00,250 INFO First message\n')
+        self.traceback_filename = os.path.join(self.folder, 'traceback.log')
+        with open(self.traceback_filename, 'w') as text_file:
+            text_file.write('2017-03-01 23:59:59,000 ERROR Failure\n')
+            text_file.write('Traceback (most recent call last):\n')
+            text_file.write('  File "app.py", line 1, in <module>\n')
+            text_file.write('ZeroDivisionError: division by zero\n')
+
+    def tearDown(self):
+        """ Removes the temporary folder
+        """
+        shutil.rmtree(self.folder)
+
+    def make_backfill(self, **kwargs):
+        self.transport = CMRESMemoryTransport()
+        handler = CMRESHandler(es_index_name="pythontest",
+                               buffer_size=100,
+                               transport=self.transport)
+        return CMRESBackfill(handler, **kwargs)
+
+    def test_backfill_json_lines_in_parallel(self):
+        """ Test the JSON lines are indexed with their own timestamps on a pool of processes
+        """
+        backfill = self.make_backfill(processes=2, log_format='json', additional_fields={'App': 'Test'})
+        self.assertEqual(250, backfill.run([self.json_filename]))
+        self.assertEqual(251, backfill.lines)
+        self.assertEqual(1, backfill.skipped)
+        documents = sorted(self.transport.documents, key=lambda doc: doc['LineNum'])
+        self.assertEqual(list(range(250)), [doc['LineNum'] for doc in documents])
+        indices = dict((json.loads(action['_source'])['LineNum'], action['_index'])
+                       for action in self.transport.actions)
+        self.assertEqual('pythontest-2017.03.01', indices[0])
+        self.assertEqual('pythontest-2017.03.02', indices[1])
+        self.assertEqual(set(['python_log']), set(action['_type'] for action in self.transport.actions))
+        self.assertEqual('2017-03-02T10:00:00.250Z', documents[1]['timestamp'])
+        self.assertEqual('Test', documents[1]['App'])
+        self.assertNotIn('levelno', documents[1])
+
+    def test_backfill_text_lines(self):
+        """ Test plain text lines are indexed as messages using the leading date or the file time
+        """
+        backfill = self.make_backfill(processes=1, log_format='auto')
+        self.assertEqual(2, backfill.run([self.text_filename]))
+        first, second = self.transport.documents
+        self.assertEqual(CMRESHandler._get_es_datetime_str(os.path.getmtime(self.text_filename)),
+                         first['timestamp'])
+        self.assertEqual('2017-03-01 10:00:00,250 INFO First message', second['message'])
+        self.assertEqual(CMRESHandler._get_es_datetime_str(
+            time.mktime(datetime.datetime(2017, 3, 1, 10, 0, 0).timetuple()) + 0.25), second['timestamp'])
+
+    def test_backfill_continuation_lines_use_previous_timestamp(self):
+        """ Test lines without a timestamp, such as a traceback, get the timestamp of the line before them
+        """
+        backfill = self.make_backfill(processes=1, log_format='text')
+        self.assertEqual(4, backfill.run([self.traceback_filename]))
+        self.assertEqual(1, len(set(doc['timestamp'] for doc in self.transport.documents)))
+        self.assertEqual(1, len(set(action['_index'] for action in self.transport.actions)))
+
+    def test_backfill_continuation_lines_across_chunks(self):
+        """ Test chunks are not cut inside a traceback when the file spans several chunks
+        """
+        with open(self.traceback_filename) as text_file:
+            traceback_lines = text_file.read()
+        with open(self.traceback_filename, 'w') as text_file:
+            text_file.write(traceback_lines * 5)
+        self.transport = CMRESMemoryTransport()
+        handler = CMRESHandler(es_index_name="pythontest", buffer_size=3, transport=self.transport)
+        backfill = CMRESBackfill(handler, processes=2, log_format='text')
+        self.assertEqual(20, backfill.run([self.traceback_filename]))
+        self.assertEqual(set(['pythontest-2017.03.01']), set(action['_index'] for action in self.transport.actions))
+        self.assertEqual(1, len(set(doc['timestamp'] for doc in self.transport.documents)))
+
+    def test_backfill_counts_rejected_documents(self):
+        """ Test documents rejected by elasticsearch are counted as failed and the backfill carries on
+        """
+        self.transport = RejectingTransport()
+        handler = CMRESHandler(es_index_name="pythontest", buffer_size=100, transport=self.transport)
+        backfill = CMRESBackfill(handler, processes=1, log_format='json')
+        self.assertEqual(247, backfill.run([self.json_filename]))
+        self.assertEqual(3, backfill.failed)
+        self.assertEqual(247, len(self.transport.actions))
+
+    def test_backfill_reports_and_closes_when_aborted(self):
+        """ Test the transport is closed and the throughput reported when sending fails
+        """
+        transport = FailingTransport()
+        handler = CMRESHandler(es_index_name="pythontest", buffer_size=100, transport=transport)
+        report_stream = io.StringIO()
+        backfill = CMRESBackfill(handler, processes=1, log_format='json', report_stream=report_stream)
+        self.assertRaises(ConnectionError, backfill.run, [self.json_filename])
+        self.assertTrue(transport.closed)
+        self.assertTrue(report_stream.getvalue().startswith('Aborted: '))
+
+    def test_handler_creates_a_single_client_across_threads(self):
+        """ Test concurrent sends through the handler transport share a single elasticsearch client
+        """
+        def slow_client(**kwargs):
+            time.sleep(0.05)
+            return object()
+
+        handler = CMRESHandler(es_index_name="pythontest")
+        get_client = handler._CMRESHandler__get_es_client
+        senders = multiprocessing.pool.ThreadPool(8)
+        try:
+            with mock.patch('cmreslogging.handlers.Elasticsearch', side_effect=slow_client):
+                clients = senders.map(lambda _: get_client(), range(16), chunksize=1)
+        finally:
+            senders.terminate()
+            senders.join()
+        self.assertEqual(1, len(set(id(client) for client in clients)))
+
+    def test_parse_timestamp(self):
+        """ Test epochs in seconds or milliseconds, UTC and offset dates are parsed and invalid ones ignored
+        """
+        utc_epoch = calendar.timegm((2017, 3, 1, 10, 0, 0, 0, 0, 0))
+        self.assertEqual(utc_epoch + 0.25, _parse_timestamp(utc_epoch + 0.25))
+        self.assertEqual(utc_epoch + 0.25, _parse_timestamp(utc_epoch * 1000 + 250))
+        self.assertEqual(utc_epoch + 0.25, _parse_timestamp('2017-03-01T10:00:00.250Z'))
+        self.assertEqual(utc_epoch - 7200, _parse_timestamp('2017-03-01T10:00:00+02:00'))
+        self.assertEqual(utc_epoch + 19800, _parse_timestamp('2017-03-01T10:00:00-0530'))
+        self.assertIsNone(_parse_timestamp(1e20))
+        self.assertIsNone(_parse_timestamp('2017-13-45T10:00:00Z'))
+        self.assertIsNone(_parse_timestamp(True))
+        self.assertIsNone(_parse_timestamp('not a date'))
+
+    def test_main_writes_output_file(self):
+        """ Test the command line entry point using the file transport
+        """
+        output_filename = os.path.join(self.folder, 'out.ndjson')
+        self.assertEqual(0, main(['--output-file', output_filename, '--processes', '1',
+                                  '--report-every', '0', '--field', 'Environment=Dev',
+                                  self.text_filename, self.json_filename]))
+        with open(output_filename) as ndjson_file:
+            documents = [json.loads(line) for line in ndjson_file]
+        self.assertEqual(253, len(documents))
+        self.assertTrue(all(document['Environment'] == 'Dev' for document in documents))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+""" Test class for the connections module
+"""
+import unittest
+import collections
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath('.'))
+from elasticsearch import ConnectionError
+from cmreslogging.connections import CMRESHostStats, CMRESLatencySelector, CMRESTrackedConnection
+from cmreslogging.handlers import CMRESHandler
+
+
+class FakeConnection(object):
+    def __init__(self, host, host_stats):
+        self.host = host
+        self.host_stats = host_stats
+
+
+class CMRESConnectionsTestCase(unittest.TestCase):
+    """ CMRESHostStats, CMRESLatencySelector and CMRESTrackedConnection test class
+    """
+
+    def test_host_stats_cool_down_is_exponential(self):
+        """ Test consecutive failures double the cool down up to the maximum and a success clears it
+        """
+        host_stats = CMRESHostStats(cool_down_in_sec=1, max_cool_down_in_sec=5)
+        for expected_cool_down in [1, 2, 4, 5]:
+            host_stats.record_failure('http://host1:9200', now=100)
+            self.assertEqual(100 + expected_cool_down, host_stats.snapshot()['http://host1:9200']['cooled_until'])
+        self.assertFalse(host_stats.is_available('http://host1:9200', now=104))
+        self.assertTrue(host_stats.is_available('http://host1:9200', now=105))
+        self.assertTrue(host_stats.is_available('http://host2:9200', now=100))
+        host_stats.record_success('http://host1:9200', 0.5)
+        self.assertEqual(0, host_stats.snapshot()['http://host1:9200']['failures'])
+        self.assertTrue(host_stats.is_available('http://host1:9200', now=100))
+
+    def test_selector_favours_fastest_healthy_hosts(self):
+        """ Test the selector sends most requests to the fastest host and none to the cooled down ones
+        """
+        host_stats = CMRESHostStats()
+        connections = [FakeConnection(host, host_stats) for host in ['fast', 'slow', 'failing']]
+        host_stats.record_success('fast', 0.01)
+        host_stats.record_success('slow', 2)
+        host_stats.record_failure('failing')
+        selector = CMRESLatencySelector({})
+        selected = collections.Counter(selector.select(connections).host for _ in range(1000))
+        self.assertEqual(0, selected['failing'])
+        self.assertGreater(selected['fast'], 600)
+        self.assertGreater(selected['slow'], 0)
+
+        selected = collections.Counter(selector.select(connections[:2]).host for _ in range(1000))
+        self.assertGreater(selected['slow'], 0)
+        self.assertLess(selected['slow'], 80)
+
+    def test_selector_ranks_failing_hosts_behind_measured_ones(self):
+        """ Test a host that only ever failed is not preferred once its cool down expires
+        """
+        host_stats = CMRESHostStats()
+        connections = [FakeConnection(host, host_stats) for host in ['healthy', 'failing']]
+        host_stats.record_success('healthy', 0.5)
+        host_stats.record_failure('failing', now=0)
+        self.assertTrue(host_stats.is_available('failing'))
+        self.assertEqual(0.0, host_stats.score('unknown'))
+        self.assertGreater(host_stats.score('failing'), host_stats.score('healthy'))
+        selector = CMRESLatencySelector({})
+        selected = collections.Counter(selector.select(connections).host for _ in range(1000))
+        self.assertGreater(selected['healthy'], 900)
+        self.assertGreater(selected['failing'], 0)
+
+    def test_handler_kerberos_client_does_not_sniff_on_start(self):
+        """ Test the kerberos client, created on every flush, only sniffs on connection failures
+        """
+        handler = CMRESHandler(hosts=[{'host': 'host1', 'port': 9200}], sniff_hosts=True)
+        kwargs = handler._CMRESHandler__get_connection_kwargs(sniff_on_start=False)
+        self.assertFalse(kwargs['sniff_on_start'])
+        self.assertTrue(kwargs['sniff_on_connection_fail'])
+        self.assertTrue(handler._CMRESHandler__get_connection_kwargs()['sniff_on_start'])
+
+    def test_tracked_connection_records_failures(self):
+        """ Test a connection error is recorded as a failure of the host
+        """
+        host_stats = CMRESHostStats()
+        connection = CMRESTrackedConnection(host='localhost', port=1, host_stats=host_stats, timeout=1)
+        self.assertRaises(ConnectionError, connection.perform_request, 'HEAD', '/')
+        self.assertEqual(1, host_stats.snapshot()[connection.host]['failures'])
+        self.assertFalse(host_stats.is_available(connection.host))
+
+    def test_handler_client_uses_latency_aware_selection(self):
+        """ Test the handler builds its client with the tracked connections and the latency selector
+        """
+        handler = CMRESHandler(hosts=[{'host': 'host1', 'port': 9200}, {'host': 'host2', 'port': 9200}],
+                               auth_type=CMRESHandler.AuthType.BASIC_AUTH,
+                               auth_details=('User', 'Password'))
+        client = handler._CMRESHandler__get_es_client()
+        self.assertIs(client, handler._CMRESHandler__get_es_client())
+        self.assertIsInstance(client.transport.connection_pool.selector, CMRESLatencySelector)
+        for connection in client.transport.connection_pool.connections:
+            self.assertIsInstance(connection, CMRESTrackedConnection)
+            self.assertIs(handler.host_stats, connection.host_stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,15 @@ import logging
 import time
 import os
 import sys
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 sys.path.insert(0, os.path.abspath('.'))
 from cmreslogging.handlers import CMRESHandler
+from cmreslogging.transports import CMRESMemoryTransport
 
 
 class CMRESHandlerTestCase(unittest.TestCase):
@@ -123,6 +130,77 @@ class CMRESHandlerTestCase(unittest.TestCase):
         handler.flush()
         self.assertEqual(0, len(handler._buffer))
 
+    def test_buffered_log_insertion_into_custom_transport(self):
+        transport = CMRESMemoryTransport()
+        handler = CMRESHandler(hosts=[{'host': self.getESHost(), 'port': self.getESPort()}],
+                               buffer_size=50,
+                               flush_frequency_in_sec=1000,
+                               es_index_name="pythontest",
+                               es_additional_fields={'App': 'Test', 'Environment': 'Dev'},
+                               raise_on_indexing_exceptions=True,
+                               transport=transport)
+        log = logging.getLogger("PythonTransportTest")
+        log.setLevel(logging.DEBUG)
+        log.addHandler(handler)
+        for i in range(120):
+            log.info("Logging line {0:d}".format(i), extra={'LineNum': i})
+        self.assertEqual(100, len(transport.actions))
+        self.assertEqual(20, len(handler._buffer))
+        handler.close()
+        log.removeHandler(handler)
+        self.assertEqual(0, len(handler._buffer))
+        self.assertEqual(list(range(120)), [doc['LineNum'] for doc in transport.documents])
+        self.assertEqual(handler._index_name_func.__func__("pythontest"), transport.actions[0]['_index'])
+        self.assertEqual('python_log', transport.actions[0]['_type'])
+        self.assertEqual('Test', transport.documents[0]['App'])
+
+    def test_exception_log_is_structured(self):
+        transport = CMRESMemoryTransport()
+        handler = CMRESHandler(hosts=[{'host': self.getESHost(), 'port': self.getESPort()}],
+                               es_index_name="pythontest",
+                               raise_on_indexing_exceptions=True,
+                               transport=transport)
+        log = logging.getLogger("PythonExceptionTest")
+        log.addHandler(handler)
+        try:
+            raise ValueError("Bad value")
+        except ValueError:
+            log.exception("Exception Message")
+        log.warning("Plain Message")
+        handler.close()
+        log.removeHandler(handler)
+        exception_doc, plain_doc = transport.documents
+        self.assertNotIn('exc_info', plain_doc)
+        for key in set(exception_doc) & set(plain_doc):
+            self.assertEqual(isinstance(exception_doc[key], dict), isinstance(plain_doc[key], dict),
+                             "Field {0!s} would be mapped differently".format(key))
+        exc_info = transport.documents[0]['exc_info']
+        self.assertEqual('ValueError', exc_info['type'])
+        self.assertEqual('Bad value', exc_info['message'])
+        self.assertEqual('test_exception_log_is_structured', exc_info['frames'][-1]['function'])
+        self.assertIn('Bad value', transport.documents[0]['exc_text'])
+
+    def test_repeated_exception_is_not_formatted_again(self):
+        transport = CMRESMemoryTransport()
+        handler = CMRESHandler(es_index_name="pythontest", transport=transport)
+        log = logging.getLogger("PythonRepeatedExceptionTest")
+        log.addHandler(handler)
+        with mock.patch.object(logging.Formatter, 'formatException') as format_exception:
+            for _ in range(3):
+                try:
+                    raise ValueError("Bad value")
+                except ValueError:
+                    log.exception("Exception Message")
+        handler.close()
+        log.removeHandler(handler)
+        self.assertFalse(format_exception.called)
+        exc_texts = [document['exc_text'] for document in transport.documents]
+        self.assertEqual(3, len(exc_texts))
+        self.assertEqual(1, len(set(exc_texts)))
+        self.assertTrue(exc_texts[0].startswith("Traceback (most recent call last):"))
+        self.assertIn("test_repeated_exception_is_not_formatted_again", exc_texts[0])
+        self.assertTrue(exc_texts[0].endswith("ValueError: Bad value"))
+
     def test_index_name_frequency_functions(self):
         index_name = "pythontest"
         handler = CMRESHandler(hosts=[{'host': self.getESHost(), 'port': self.getESPort()}],
@@ -90,6 +90,31 @@ class CMRESSerializerTestCase(unittest.TestCase):
             except TypeError:
                 self.fail("Serializer raised a TypeError exception")
 
+    def test_serialize_exc_info_caches_frames(self):
+        """ Test the exception is serialized as a structure and its frames are cached by code location
+        """
+        serializer = CMRESSerializer()
+        exc_infos = []
+        for _ in range(2):
+            try:
+                bad_idea = 1/0
+            except ZeroDivisionError:
+                exc_infos.append(sys.exc_info())
+        first = serializer.serialize_exc_info(exc_infos[0])
+        second = serializer.serialize_exc_info(exc_infos[1])
+        self.assertEqual('ZeroDivisionError', first['type'])
+        self.assertEqual(str(exc_infos[0][1]), first['message'])
+        self.assertEqual(1, len(first['frames']))
+        frame = first['frames'][0]
+        self.assertEqual('test_serialize_exc_info_caches_frames', frame['function'])
+        self.assertEqual('bad_idea = 1/0', frame['line'])
+        self.assertIs(frame, second['frames'][0])
+        self.assertIsNone(serializer.serialize_exc_info((None, None, None)))
+        try:
+            serializer.dumps(first)
+        except TypeError:
+            self.fail("Serializer raised a TypeError exception")
+
 
 if __name__ == '__main__':
   unittest.main()
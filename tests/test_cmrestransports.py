@@ -0,0 +1,137 @@
+""" Test class for the transports module
+"""
+import unittest
+import io
+import json
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.abspath('.'))
+from elasticsearch.helpers import BulkIndexError
+from cmreslogging.serializers import CMRESSerializer
+from cmreslogging.transports import CMRESElasticsearchTransport, CMRESFileTransport, CMRESMemoryTransport
+
+
+class FakeClient(object):
+    """ Elasticsearch client rejecting the first document of every bulk request
+    """
+    class Transport(object):
+        serializer = CMRESSerializer()
+
+    def __init__(self):
+        self.transport = FakeClient.Transport()
+        self.documents = 0
+
+    def bulk(self, body, *args, **kwargs):
+        items = body.splitlines()[::2]
+        self.documents += len(items)
+        return {'errors': True,
+                'items': [{'index': {'status': 400 if i == 0 else 201}} for i in range(len(items))]}
+
+
+class CMRESTransportsTestCase(unittest.TestCase):
+    """ CMRESFileTransport and CMRESMemoryTransport test class
+    """
+
+    def setUp(self):
+        """ Creates a temporary folder for the file transport
+        """
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'python_logger.ndjson')
+
+    def tearDown(self):
+        """ Removes the temporary folder
+        """
+        shutil.rmtree(self.folder)
+
+    @staticmethod
+    def make_actions(count, start=0):
+        return [{'_index': 'pythontest', '_type': 'python_log', '_source': {'msg': 'Line', 'LineNum': i}}
+                for i in range(start, start + count)]
+
+    def test_memory_transport_stores_documents(self):
+        """ Test the memory transport keeps every document sent
+        """
+        transport = CMRESMemoryTransport()
+        transport.send(iter(self.make_actions(3)))
+        transport.send(self.make_actions(2, start=3))
+        self.assertEqual(5, len(transport.actions))
+        self.assertEqual(list(range(5)), [doc['LineNum'] for doc in transport.documents])
+        transport.clear()
+        self.assertEqual([], transport.documents)
+
+    def test_elasticsearch_transport_sends_every_action_before_raising(self):
+        """ Test rejected documents are raised once every bulk request has been sent
+        """
+        client = FakeClient()
+        transport = CMRESElasticsearchTransport(lambda: client)
+        with self.assertRaises(BulkIndexError) as context:
+            transport.send(self.make_actions(1200))
+        self.assertEqual(1200, client.documents)
+        self.assertEqual(3, len(context.exception.errors))
+
+    def test_file_transport_writes_ndjson(self):
+        """ Test the file transport writes one JSON document per line
+        """
+        transport = CMRESFileTransport(self.filename)
+        transport.send(self.make_actions(3))
+        transport.send([])
+        transport.close()
+        transport.send(self.make_actions(1, start=3))
+        transport.close()
+        with open(self.filename) as ndjson_file:
+            lines = ndjson_file.read().splitlines()
+        self.assertEqual(list(range(4)), [json.loads(line)['LineNum'] for line in lines])
+
+    def test_file_transport_writes_non_ascii_documents(self):
+        """ Test documents with non ASCII text, as text or already encoded, are written in the file encoding
+        """
+        transport = CMRESFileTransport(self.filename)
+        transport.send([{'_index': 'pythontest', '_type': 'python_log', '_source': {'msg': u'Caf\u00e9 \u2603'}},
+                        {'_index': 'pythontest', '_type': 'python_log',
+                         '_source': u'{"msg": "Se\u00f1al"}'.encode('utf-8')}])
+        transport.close()
+        with io.open(self.filename, encoding='utf-8') as ndjson_file:
+            self.assertEqual([u'Caf\u00e9 \u2603', u'Se\u00f1al'], [json.loads(line)['msg'] for line in ndjson_file])
+
+    def test_file_transport_rotates_on_batch_boundaries(self):
+        """ Test the file transport rotates and keeps the configured number of backups
+        """
+        transport = CMRESFileTransport(self.filename, max_bytes=100, backup_count=2)
+        for batch in range(4):
+            transport.send(self.make_actions(3, start=batch * 3))
+        transport.close()
+        self.assertTrue(os.path.exists(self.filename + '.1'))
+        self.assertTrue(os.path.exists(self.filename + '.2'))
+        self.assertFalse(os.path.exists(self.filename + '.3'))
+        line_numbers = []
+        for filename in [self.filename + '.2', self.filename + '.1', self.filename]:
+            with open(filename) as ndjson_file:
+                lines = ndjson_file.read().splitlines()
+            self.assertEqual(3, len(lines))
+            line_numbers.extend(json.loads(line)['LineNum'] for line in lines)
+        self.assertEqual(list(range(3, 12)), line_numbers)
+
+    def test_file_transport_reopens_moved_file(self):
+        """ Test the file transport reopens the file when it is moved and rotates when it is missing
+        """
+        transport = CMRESFileTransport(self.filename, max_bytes=100, backup_count=1)
+        transport.send(self.make_actions(1))
+        os.rename(self.filename, self.filename + '.shipped')
+        transport.send(self.make_actions(1, start=1))
+        with open(self.filename) as ndjson_file:
+            self.assertEqual([1], [json.loads(line)['LineNum'] for line in ndjson_file])
+        with open(self.filename + '.shipped') as ndjson_file:
+            self.assertEqual([0], [json.loads(line)['LineNum'] for line in ndjson_file])
+        transport.send(self.make_actions(2, start=2))
+        os.remove(self.filename)
+        transport.send(self.make_actions(3, start=4))
+        transport.close()
+        with open(self.filename) as ndjson_file:
+            self.assertEqual([4, 5, 6], [json.loads(line)['LineNum'] for line in ndjson_file])
+
+
+if __name__ == '__main__':
+    unittest.main()